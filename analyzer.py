@@ -9,14 +9,32 @@ Pyflakes warnings, large additions, and possible secrets.
 from __future__ import annotations
 
 import ast
+import hashlib
 import logging
+import os
 import re
-import shutil
-import subprocess
-import tempfile
-from typing import Any, Dict, List, Optional
-
-from radon.complexity import cc_visit
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pyflakes
+import radon
+from diskcache import Cache
+from pyflakes.api import check as pyflakes_check
+from pyflakes.reporter import Reporter
+from radon.complexity import cc_visit_ast
+
+try:
+    import hyperscan
+except ImportError:  # optional accelerator for detect_secrets
+    hyperscan = None
+
+try:
+    import ahocorasick
+except ImportError:  # optional, used by detect_secrets when hyperscan is missing
+    ahocorasick = None
 
 # ---------------------------
 # Logger
@@ -40,197 +58,386 @@ MAX_PENALTY_PER_ISSUE = {
     "secret": 25,
     "large_addition": 5,
 }
+_PENALTY_FACTORS = {
+    "todo": PENALTY_TODO,
+    "complexity": PENALTY_COMPLEXITY,
+    "docstring": PENALTY_DOCSTRING,
+    "pyflakes": PENALTY_PYFLAKES,
+    "print": PENALTY_PRINT,
+    "secret": MAX_PENALTY_PER_ISSUE.get("secret", 25),
+    "large_addition": MAX_PENALTY_PER_ISSUE.get("large_addition", 5),
+}
 
 SECRET_KEYWORDS = ["PRIVATE_KEY", "API_KEY", "SECRET", "TOKEN"]
 
+# Precompiled patch patterns
+_ADDED_RE = re.compile(r"^\+(?!\+\+)(.*)", re.M)
+_PRINT_RE = re.compile(r"\bprint\s*\(")
+# AST fields holding statement lists (handlers/cases hold their own bodies)
+_STMT_LIST_FIELDS = ("body", "orelse", "finalbody", "handlers", "cases")
+# Lockfiles, minified assets and vendored/generated trees are not analyzed
+_SKIP_RE = re.compile(
+    r"(?:^|/)(?:package-lock\.json|yarn\.lock|[^/]+\.min\.(?:js|css))$"
+    r"|(?:^|/)(?:vendor|generated)/"
+)
+
+# Files are analyzed concurrently by a thread pool of this size
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+# Per-file results are cached on disk; an empty ANALYSIS_CACHE_DIR disables it.
+# Bump ANALYZER_VERSION whenever this module's per-file results change; tool
+# and Python upgrades change the key on their own.
+ANALYZER_VERSION = "3"
+_CACHE_KEY_VERSIONS = "|".join(
+    (
+        ANALYZER_VERSION,
+        pyflakes.__version__,
+        radon.__version__,
+        "%d.%d" % sys.version_info[:2],
+    )
+)
+CACHE_DIR = os.environ.get("ANALYSIS_CACHE_DIR", "~/.cache/pr-review-agent")
+RESULT_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+
+def _open_result_cache() -> Optional[Cache]:
+    """Open the on-disk result cache; None if disabled or not writable."""
+    if not CACHE_DIR:
+        return None
+    try:
+        return Cache(os.path.expanduser(CACHE_DIR))
+    except Exception as exc:
+        # e.g. a read-only HOME on PaaS hosts: run uncached rather than fail
+        logger.warning("Result cache disabled, cannot open %s: %s", CACHE_DIR, exc)
+        return None
+
+
+_result_cache = _open_result_cache()
+
+
+def _compile_secret_db() -> Optional[Any]:
+    """Compile SECRET_KEYWORDS into one Hyperscan database; None if unavailable."""
+    if hyperscan is None:
+        return None
+    db = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+    db.compile(
+        expressions=[re.escape(k).encode() for k in SECRET_KEYWORDS],
+        ids=list(range(len(SECRET_KEYWORDS))),
+        elements=len(SECRET_KEYWORDS),
+        flags=[hyperscan.HS_FLAG_SINGLEMATCH] * len(SECRET_KEYWORDS),
+    )
+    return db
+
+
+def _build_secret_automaton() -> Optional[Any]:
+    """Build an Aho-Corasick automaton over SECRET_KEYWORDS; None if unavailable."""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for k in SECRET_KEYWORDS:
+        automaton.add_word(k, k)
+    automaton.make_automaton()
+    return automaton
+
+
+_SECRET_DB = _compile_secret_db()
+_SECRET_AUTOMATON = _build_secret_automaton() if _SECRET_DB is None else None
+# Hyperscan scratch space must not be shared between concurrent scans
+_hs_local = threading.local()
+
+
+def _secret_scratch() -> Any:
+    """Return this thread's Hyperscan scratch space for _SECRET_DB."""
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_SECRET_DB)
+    return scratch
+
 
 # ---------------------------
 # Helpers
 # ---------------------------
 def extract_added_code(patch_text: str) -> str:
     """Return concatenated added lines (prefixed by '+') from a git patch."""
-    added_lines: List[str] = [
-        line[1:]
-        for line in patch_text.splitlines()
-        if line.startswith("+") and not line.startswith("+++")
-    ]
-    return "\n".join(added_lines)
+    return "\n".join(_ADDED_RE.findall(patch_text))
 
 
 def count_todos(patch_text: str) -> int:
-    """Count TODO/FIXME markers in a patch."""
-    return sum(1 for l in patch_text.splitlines() if "TODO" in l or "FIXME" in l)
+    """
+    Count TODO/FIXME markers in a patch.
+    Counts occurrences, so a line carrying both markers counts twice.
+    """
+    return patch_text.count("TODO") + patch_text.count("FIXME")
 
 
-def python_complexity_from_code(code_text: str) -> Optional[Dict[str, Any]]:
+def _parse_python(code_text: str) -> Optional[ast.Module]:
     """
-    Compute cyclomatic complexity using radon.
-    Returns dict with average, high count, and details. None if invalid code.
+    Parse code once and share the tree between the AST-based checks.
+    Returns None if the code is not valid Python.
     """
     try:
-        blocks = cc_visit(code_text)
-        if not blocks:
-            return None
-        avg = sum(b.complexity for b in blocks) / len(blocks)
-        high = [b for b in blocks if b.complexity >= 10]
-        return {
-            "avg": avg,
-            "high_count": len(high),
-            "details": [{"name": b.name, "complexity": b.complexity} for b in blocks],
-        }
+        return ast.parse(code_text)
     except Exception as exc:
-        logger.debug("Complexity analysis failed: %s", exc)
+        logger.debug("Parse failed: %s", exc)
+        return None
+
+
+def _summarize_complexity(blocks: List[Any]) -> Optional[Dict[str, Any]]:
+    """Aggregate radon blocks into average, high count, and details."""
+    if not blocks:
         return None
+    total = high_count = 0
+    for b in blocks:
+        total += b.complexity
+        if b.complexity >= 10:
+            high_count += 1
+    return {
+        "avg": total / len(blocks),
+        "high_count": high_count,
+        "details": {
+            "names": [b.name for b in blocks],
+            "complexities": [b.complexity for b in blocks],
+        },
+    }
 
 
 def uses_print_for_logging(code_text: str) -> bool:
     """Detect if print() is used for logging."""
-    return bool(re.search(r"\bprint\s*\(", code_text))
+    return _PRINT_RE.search(code_text) is not None
 
 
-def missing_docstrings(code_text: str) -> Optional[int]:
-    """Count functions/classes without docstrings; None if parse fails."""
+def analyze_python(code_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Run complexity, docstring and print() checks over a single parse.
+    Returns dict with cyclomatic, missing_docstrings and uses_print;
+    None if the code is not valid Python.
+    """
+    tree = _parse_python(code_text)
+    if tree is None:
+        return None
+
     try:
-        tree = ast.parse(code_text)
-        missing = 0
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                if not ast.get_docstring(node):
-                    missing += 1
-        return missing
+        cc = _summarize_complexity(cc_visit_ast(tree))
     except Exception as exc:
-        logger.debug("Docstring check failed: %s", exc)
-        return None
+        logger.debug("Complexity analysis failed: %s", exc)
+        cc = None
+
+    # Defs can only appear in statement lists, so walk those alone and never
+    # descend into expressions.
+    missing = 0
+    stack: List[ast.AST] = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if not ast.get_docstring(node):
+                missing += 1
+        for field in _STMT_LIST_FIELDS:
+            stack.extend(getattr(node, field, ()))
+
+    # print() calls can sit in any expression, but only a full walk needs to
+    # look for them, and only when the name appears in the text at all.
+    has_print = "print" in code_text and any(
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "print"
+        for node in ast.walk(tree)
+    )
+
+    return {"cyclomatic": cc, "missing_docstrings": missing, "uses_print": has_print}
 
 
 def run_pyflakes_on_code(code_text: str) -> List[str]:
     """
-    Run pyflakes on code using a temporary file.
-    Returns list of messages, empty if pyflakes not installed or error.
+    Run pyflakes in-process on code using an in-memory reporter.
+    Returns list of messages, empty on error.
     """
-    if shutil.which("pyflakes") is None:
-        return []
-
-    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as f:
-        f.write(code_text)
-        fname = f.name
-
+    out, err = StringIO(), StringIO()
     try:
-        out = subprocess.check_output(
-            ["pyflakes", fname], stderr=subprocess.STDOUT, text=True
-        )
-        return out.splitlines()
-    except subprocess.CalledProcessError as e:
-        return e.output.splitlines() if e.output else []
+        pyflakes_check(code_text, "<patch>", Reporter(out, err))
     except Exception as exc:
         logger.debug("Pyflakes run failed: %s", exc)
         return []
+    return (out.getvalue() + err.getvalue()).splitlines()
 
 
 def detect_secrets(code_text: str) -> List[str]:
-    """Return list of detected secret keywords found in code_text."""
-    return [k for k in SECRET_KEYWORDS if k in code_text]
+    """
+    Return list of detected secret keywords found in code_text.
+    Uses a single Hyperscan or Aho-Corasick pass when available,
+    substring checks otherwise.
+    """
+    if _SECRET_DB is None:
+        # Fast negative path: most files hold no keyword at all, and a few
+        # C-level substring scans beat a full automaton pass for that case.
+        if not any(k in code_text for k in SECRET_KEYWORDS):
+            return []
+        if _SECRET_AUTOMATON is not None:
+            found = {k for _, k in _SECRET_AUTOMATON.iter(code_text)}
+            return [k for k in SECRET_KEYWORDS if k in found]
+        return [k for k in SECRET_KEYWORDS if k in code_text]
+
+    hits: Set[int] = set()
+
+    def on_match(kw_id: int, start: int, end: int, flags: int, context: Any) -> None:
+        hits.add(kw_id)
+
+    _SECRET_DB.scan(
+        code_text.encode("utf-8", "replace"),
+        match_event_handler=on_match,
+        scratch=_secret_scratch(),
+    )
+    return [k for i, k in enumerate(SECRET_KEYWORDS) if i in hits]
 
 
 def apply_penalty(issue_type: str, count: int = 1) -> int:
     """Compute penalty capped at MAX_PENALTY_PER_ISSUE."""
-    factor = {
-        "todo": PENALTY_TODO,
-        "complexity": PENALTY_COMPLEXITY,
-        "docstring": PENALTY_DOCSTRING,
-        "pyflakes": PENALTY_PYFLAKES,
-        "print": PENALTY_PRINT,
-        "secret": MAX_PENALTY_PER_ISSUE.get("secret", 25),
-        "large_addition": MAX_PENALTY_PER_ISSUE.get("large_addition", 5),
-    }.get(issue_type, 0)
+    factor = _PENALTY_FACTORS.get(issue_type, 0)
     return min(factor * count, MAX_PENALTY_PER_ISSUE.get(issue_type, factor))
 
 
 # ---------------------------
 # Main analyzer
 # ---------------------------
-def analyze_pr(pr_data: Dict[str, Any]) -> Dict[str, Any]:
-    """
-    Analyze each file in pr_data and return summary with issues and final score.
-    """
-    results: Dict[str, Any] = {"files": []}
-    total_score = 100
+def _analyze_one_file(f: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """Analyze a single file entry; return its result and score penalty."""
+    fname = f.get("filename")
+    patch = f.get("patch", "")
+    added = extract_added_code(patch)
+    todos = count_todos(patch)
+    file_res: Dict[str, Any] = {"filename": fname, "issues": [], "metrics": {}}
     score_penalty = 0
 
-    for f in pr_data.get("files", []):
-        fname = f.get("filename")
-        patch = f.get("patch", "")
-        added = extract_added_code(patch)
-        file_res: Dict[str, Any] = {"filename": fname, "issues": [], "metrics": {}}
+    # Check TODOs
+    if todos:
+        file_res["issues"].append(
+            {"type": "todo", "detail": f"{todos} TODO/FIXME found"}
+        )
+        score_penalty += apply_penalty("todo", todos)
+
+    # Nothing added (renames, deletions, binary files): skip the code checks
+    if not added:
+        return file_res, score_penalty
+
+    # Python-specific checks
+    if fname and fname.endswith(".py"):
+        py = analyze_python(added)
+        if py is not None:
+            # AST-based detection ignores print( inside strings/comments
+            has_print = py["uses_print"]
+        else:
+            # code that does not parse falls back to a text scan
+            has_print = "print" in added and uses_print_for_logging(added)
 
-        # Check TODOs
-        todos = count_todos(patch)
-        if todos:
-            file_res["issues"].append(
-                {"type": "todo", "detail": f"{todos} TODO/FIXME found"}
-            )
-            score_penalty += apply_penalty("todo", todos)
-
-        # Python-specific checks
-        if fname and fname.endswith(".py"):
-            cc = python_complexity_from_code(added)
-            if cc:
-                file_res["metrics"]["cyclomatic"] = cc
-                if cc["avg"] > 6:
-                    file_res["issues"].append(
-                        {
-                            "type": "complexity",
-                            "detail": f"avg complexity {cc['avg']:.1f}, high count {cc['high_count']}",
-                        }
-                    )
-                    score_penalty += apply_penalty("complexity", int(cc["avg"]))
-
-            missing = missing_docstrings(added)
-            if isinstance(missing, int) and missing > 0:
+        cc = py["cyclomatic"] if py else None
+        if cc:
+            file_res["metrics"]["cyclomatic"] = cc
+            if cc["avg"] > 6:
                 file_res["issues"].append(
                     {
-                        "type": "docstring",
-                        "detail": f"{missing} missing docstrings/stubs",
+                        "type": "complexity",
+                        "detail": f"avg complexity {cc['avg']:.1f}, high count {cc['high_count']}",
                     }
                 )
-                score_penalty += apply_penalty("docstring", missing)
+                score_penalty += apply_penalty("complexity", int(cc["avg"]))
 
-            if uses_print_for_logging(added):
-                file_res["issues"].append(
-                    {
-                        "type": "print",
-                        "detail": "uses print() for logging; prefer logging module",
-                    }
-                )
-                score_penalty += apply_penalty("print")
+        missing = py["missing_docstrings"] if py else None
+        if isinstance(missing, int) and missing > 0:
+            file_res["issues"].append(
+                {
+                    "type": "docstring",
+                    "detail": f"{missing} missing docstrings/stubs",
+                }
+            )
+            score_penalty += apply_penalty("docstring", missing)
 
-            pyflakes_msgs = run_pyflakes_on_code(added)
-            if pyflakes_msgs:
-                file_res["issues"].append(
-                    {"type": "pyflakes", "detail": f"{len(pyflakes_msgs)} pyflakes warnings"}
-                )
-                file_res["metrics"]["pyflakes_messages"] = pyflakes_msgs
-                score_penalty += apply_penalty("pyflakes", len(pyflakes_msgs))
+        if has_print:
+            file_res["issues"].append(
+                {
+                    "type": "print",
+                    "detail": "uses print() for logging; prefer logging module",
+                }
+            )
+            score_penalty += apply_penalty("print")
 
-        else:
-            # Generic checks for other languages
-            if len(added) > 2000:
-                file_res["issues"].append(
-                    {
-                        "type": "large_addition",
-                        "detail": "Large addition — consider splitting",
-                    }
-                )
-                score_penalty += apply_penalty("large_addition")
+        pyflakes_msgs = run_pyflakes_on_code(added)
+        if pyflakes_msgs:
+            file_res["issues"].append(
+                {"type": "pyflakes", "detail": f"{len(pyflakes_msgs)} pyflakes warnings"}
+            )
+            file_res["metrics"]["pyflakes_messages"] = pyflakes_msgs
+            score_penalty += apply_penalty("pyflakes", len(pyflakes_msgs))
 
-            secrets_found = detect_secrets(added)
-            if secrets_found:
-                file_res["issues"].append(
-                    {"type": "secret", "detail": f"Possible secrets found: {', '.join(secrets_found)}"}
-                )
-                score_penalty += apply_penalty("secret")
+    else:
+        # Generic checks for other languages
+        if len(added) > 2000:
+            file_res["issues"].append(
+                {
+                    "type": "large_addition",
+                    "detail": "Large addition — consider splitting",
+                }
+            )
+            score_penalty += apply_penalty("large_addition")
+
+        secrets_found = detect_secrets(added)
+        if secrets_found:
+            file_res["issues"].append(
+                {"type": "secret", "detail": f"Possible secrets found: {', '.join(secrets_found)}"}
+            )
+            score_penalty += apply_penalty("secret")
+
+    return file_res, score_penalty
+
+
+def _file_cache_key(fname: Optional[str], patch: str) -> str:
+    """Content hash identifying one file's analysis result."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in (_CACHE_KEY_VERSIONS, fname or "", patch):
+        h.update(part.encode("utf-8", "replace"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _analyze_one_file_cached(f: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """_analyze_one_file backed by the on-disk result cache."""
+    fname = f.get("filename")
+    if fname and _SKIP_RE.search(fname):
+        return {"filename": fname, "issues": [], "metrics": {}, "skipped": True}, 0
+
+    if _result_cache is None:
+        return _analyze_one_file(f)
+
+    key = _file_cache_key(fname, f.get("patch", ""))
+    try:
+        cached = _result_cache.get(key)
+    except Exception as exc:
+        logger.debug("Result cache read failed: %s", exc)
+        cached = None
+    if cached is not None:
+        return cached
+
+    result = _analyze_one_file(f)
+    try:
+        _result_cache.set(key, result, expire=RESULT_CACHE_TTL)
+    except Exception as exc:
+        logger.debug("Result cache write failed: %s", exc)
+    return result
+
+
+def analyze_pr(pr_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Analyze each file in pr_data and return summary with issues and final score.
+    Files are analyzed concurrently; results keep the input order.
+    """
+    results: Dict[str, Any] = {"files": []}
+    total_score = 100
+    score_penalty = 0
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        per_file = list(ex.map(_analyze_one_file_cached, pr_data.get("files", [])))
 
+    for file_res, penalty in per_file:
         results["files"].append(file_res)
+        score_penalty += penalty
 
     final_score = max(total_score - score_penalty, 0)
     results["final_score"] = final_score
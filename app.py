@@ -1,7 +1,15 @@
 import logging
 import os
-from flask import Flask, request, render_template, jsonify
-from pr_fetcher import fetch_github_pr
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+from flask import Flask, request, render_template, jsonify, redirect, url_for
+from flask_caching import Cache
+from github import UnknownObjectException
+from pr_fetcher import PR_URL_PATTERN, fetch_github_pr, parse_local_diff
 from analyzer import analyze_pr
 
 # ------------------------------------------------------------------
@@ -20,6 +28,98 @@ logger = logging.getLogger(__name__)
 # Read configuration from environment
 DEBUG_MODE = os.environ.get("FLASK_DEBUG", "false").lower() == "true"
 PORT = int(os.environ.get("PORT", 10000))
+REVIEW_WORKERS = int(os.environ.get("REVIEW_WORKERS", 4))
+
+# Fetched PRs are memoized for PR_CACHE_TTL seconds. SimpleCache is per
+# process; set CACHE_TYPE=FileSystemCache (with CACHE_DIR) or RedisCache
+# (with CACHE_REDIS_URL) to share it between app instances.
+app.config["CACHE_TYPE"] = os.environ.get("CACHE_TYPE", "SimpleCache")
+app.config["CACHE_DEFAULT_TIMEOUT"] = int(os.environ.get("PR_CACHE_TTL", 60))
+for _key in ("CACHE_DIR", "CACHE_REDIS_URL"):
+    if _key in os.environ:
+        app.config[_key] = os.environ[_key]
+cache = Cache(app)
+
+# ------------------------------------------------------------------
+# Background reviews
+# ------------------------------------------------------------------
+
+# Reviews run off the request thread; /status/<id> polls for the result.
+# Only the most recent MAX_TRACKED_REVIEWS are kept in memory.
+MAX_TRACKED_REVIEWS = 256
+_executor = ThreadPoolExecutor(max_workers=REVIEW_WORKERS)
+_reviews: "OrderedDict[str, Future]" = OrderedDict()
+_reviews_lock = threading.Lock()
+
+
+@cache.memoize()
+def _fetch_pr_memoized(pr_url: str) -> Dict[str, Any]:
+    return fetch_github_pr(pr_url)
+
+
+def fetch_pr_cached(pr_url: str) -> Dict[str, Any]:
+    """fetch_github_pr, memoized per (repo, PR number) so repeat reviews skip GitHub."""
+    m = PR_URL_PATTERN.fullmatch(pr_url)
+    if m:
+        # ".../pull/1" and ".../pull/1/files" share one cache entry
+        pr_url = "https://github.com/{}/{}/pull/{}".format(*m.groups())
+    return _fetch_pr_memoized(pr_url)
+
+
+def _without_patches(pr_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of pr_data whose files carry no patch text (the input is not mutated)."""
+    files = [
+        {k: v for k, v in f.items() if k != "patch"} for f in pr_data.get("files", [])
+    ]
+    return {**pr_data, "files": files}
+
+
+def run_analysis(
+    pr_data: Dict[str, Any], include_patch: bool = False
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Analyze already loaded PR data; returns (pr_data, analysis).
+
+    Finished reviews are kept in memory, so patch text is dropped from the
+    result unless include_patch is set, in which case each analyzed file
+    carries its patch for the "Show Patch" toggle.
+    """
+    try:
+        logger.info("Analyzing PR")
+        analysis = analyze_pr(pr_data)
+    except Exception:
+        logger.exception("Error while analyzing PR")
+        raise
+    if include_patch:
+        for file_res, f in zip(analysis["files"], pr_data.get("files", [])):
+            file_res["patch"] = f.get("patch") or ""
+        return pr_data, analysis
+    return _without_patches(pr_data), analysis
+
+
+def run_full_pipeline(
+    pr_url: str, include_patch: bool = False
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Fetch and analyze a PR; returns (pr_data, analysis)."""
+    try:
+        logger.info("Fetching PR: %s", pr_url)
+        pr_data = fetch_pr_cached(pr_url)
+    except Exception:
+        logger.exception("Error while fetching PR")
+        raise
+    return run_analysis(pr_data, include_patch)
+
+
+def submit_review(
+    job: Callable[..., Tuple[Dict[str, Any], Dict[str, Any]]], *args: Any
+) -> str:
+    """Queue job(*args) on the background pool and return its review id."""
+    review_id = uuid.uuid4().hex
+    future = _executor.submit(job, *args)
+    with _reviews_lock:
+        _reviews[review_id] = future
+        while len(_reviews) > MAX_TRACKED_REVIEWS:
+            _reviews.popitem(last=False)
+    return review_id
 
 # ------------------------------------------------------------------
 # Routes
@@ -27,32 +127,61 @@ PORT = int(os.environ.get("PORT", 10000))
 
 @app.route("/", methods=["GET"])
 def index() -> str:
-    """Render home page with form to submit PR URL."""
+    """Render home page with form to submit a PR URL or diff file."""
     return render_template("index.html")
 
 @app.route("/review", methods=["POST"])
 def review():
-    """Handle PR review requests."""
+    """Handle review requests for a GitHub PR URL or an uploaded diff file."""
     pr_url = (request.form.get("pr_url") or "").strip()
-    if not pr_url:
-        logger.warning("No PR URL provided")
-        return jsonify({"error": "No PR URL provided"}), 400
+    diff_file = request.files.get("diff_file")
+    include_patch = request.values.get("include_patch", "").lower() in ("1", "true", "on")
 
-    try:
-        logger.info("Fetching PR: %s", pr_url)
-        pr_data = fetch_github_pr(pr_url)
-        logger.info("Analyzing PR")
-        analysis = analyze_pr(pr_data)
-        # Pass data to template
-        return render_template("result.html", pr_data=pr_data, analysis=analysis)
+    if pr_url:
+        review_id = submit_review(run_full_pipeline, pr_url, include_patch)
+    elif diff_file:
+        # The upload is only readable during this request, so parse it here,
+        # line by line, and leave just the analysis to the background pool.
+        # Binary iteration splits on "\n" only; a text wrapper would also
+        # break lines at a lone "\r" inside added code.
+        lines = (raw.decode("utf-8") for raw in diff_file.stream)
+        try:
+            pr_data = parse_local_diff(lines)
+        except UnicodeDecodeError:
+            logger.warning("Diff file is not UTF-8 text")
+            return jsonify({"error": "Diff file must be UTF-8 text"}), 400
+        review_id = submit_review(run_analysis, pr_data, include_patch)
+    else:
+        logger.warning("No PR URL or diff file provided")
+        return jsonify({"error": "No PR URL or diff file provided"}), 400
 
-    except Exception as exc:
-        logger.exception("Error while processing PR")
+    return redirect(url_for("status", review_id=review_id), code=303)
+
+@app.route("/status/<review_id>", methods=["GET"])
+def status(review_id: str):
+    """Show a pending page until the review finishes, then its result."""
+    with _reviews_lock:
+        future = _reviews.get(review_id)
+    if future is None:
+        return jsonify({"error": "Unknown review id"}), 404
+    if not future.done():
+        return render_template("pending.html"), 202
+
+    exc = future.exception()
+    if isinstance(exc, ValueError):
+        return jsonify({"error": str(exc)}), 400
+    if isinstance(exc, UnknownObjectException):
+        return jsonify({"error": "PR not found or repository is private"}), 404
+    if exc is not None:
         if DEBUG_MODE:
             # Show detailed error in debug
             return jsonify({"error": str(exc)}), 500
         return jsonify({"error": "Internal Server Error"}), 500
 
+    pr_data, analysis = future.result()
+    # Pass data to template
+    return render_template("result.html", pr_data=pr_data, analysis=analysis)
+
 # ------------------------------------------------------------------
 # Entry point
 # ------------------------------------------------------------------
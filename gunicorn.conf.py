@@ -0,0 +1,21 @@
+"""
+Gunicorn settings for PR Review Agent.
+
+Loaded automatically when gunicorn is started from the project root,
+e.g. `gunicorn app:app`.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Requests mostly wait on GitHub, so threaded workers multiplex them
+# instead of pinning a whole worker process per in-flight request.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Reviews are tracked in-process (see app.py), so status polls must reach
+# the worker that accepted the review. Keep exactly one worker until review
+# state is shared; WEB_CONCURRENCY is deliberately not read, since PaaS
+# buildpacks set it automatically.
+workers = 1
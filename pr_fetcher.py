@@ -1,72 +1,240 @@
 """
-PR Review Agent Flask App.
+PR fetcher module for PR Review Agent.
 
-Provides endpoints to:
-- fetch and analyze a GitHub pull request by URL
+Provides helpers to:
+- fetch a GitHub pull request by URL
 - parse a local diff file in PR-like format
 """
 
 from __future__ import annotations
 
+import io
+import json
 import logging
 import os
 import re
-from typing import Any, Dict, List
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from flask import Flask, jsonify, render_template, request
-from github import Github, GithubException
+from github import Github
+from github.PullRequest import PullRequest
 
 # ---------------------------------------
-# Setup Flask and logging
+# Logger
 # ---------------------------------------
-app = Flask(__name__)
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 # Environment token
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 
+# Largest page size GitHub allows for list endpoints (the default is 30)
+GITHUB_PAGE_SIZE = 100
+
+# The PR files endpoint stops listing after 3000 files
+GITHUB_MAX_FILES = 3000
+
+# Concurrent requests used to fetch pages of the PR file list
+MAX_PAGE_WORKERS = 8
+
+# GitHub refuses (406) to render a PR as a single diff beyond this many files
+GITHUB_MAX_DIFF_FILES = 300
+
 # Precompile PR URL regex
-PR_URL_PATTERN = re.compile(r"https://github\.com/([^/]+/[^/]+)/pull/(\d+)")
+# Groups: owner, repo, PR number. Anything after the number must start a new
+# path segment, query or fragment (e.g. ".../pull/123/files").
+PR_URL_PATTERN = re.compile(
+    r"https://github\.com/([^/]+)/([^/]+)/pull/(\d+)(?:[/?#].*)?"
+)
+
+# Last fetched PR per (repo, number) as (ETag, pr_info, last used, patch
+# size), least recently used first; revalidated with If-None-Match so
+# unchanged PRs cost a 304. Entries hold whole diffs, so the cache is bounded
+# by entry count, total patch size and idle time.
+MAX_ETAG_ENTRIES = 32
+MAX_ETAG_PATCH_CHARS = 32 * 1024 * 1024
+ETAG_CACHE_TTL = 600  # seconds
+_etag_cache: "OrderedDict[Tuple[str, int], Tuple[str, Dict[str, Any], float, int]]" = (
+    OrderedDict()
+)
+_etag_patch_chars = 0
+_etag_lock = threading.Lock()
 
 # ---------------------------------------
 # GitHub PR Fetcher
 # ---------------------------------------
+def _github_client() -> Github:
+    """Create a Github client, authenticated when GITHUB_TOKEN is set."""
+    return Github(GITHUB_TOKEN) if GITHUB_TOKEN else Github()
+
+
+def _fetch_files_from_diff(gh: Github, pulls_url: str) -> Optional[List[Dict[str, Any]]]:
+    """Fetch a PR as one unified diff and split it into files.
+
+    Returns None when GitHub declines to render the diff (406).
+    """
+    status, resp_headers, output = gh.requester.requestJson(
+        "GET", pulls_url, headers={"Accept": "application/vnd.github.v3.diff"}
+    )
+    if status == 406:
+        logger.info("Diff too large for %s, listing files instead", pulls_url)
+        return None
+    if status >= 400:
+        try:
+            raw = json.loads(output) if output else {}
+        except ValueError:
+            raw = {"message": output}
+        raise gh.requester.createException(status, resp_headers, raw)
+    return parse_local_diff(output)["files"]
+
+
+def _fetch_files_paged(
+    gh: Github, pulls_url: str, changed_files: int
+) -> List[Dict[str, Any]]:
+    """Fetch a PR's files from the paged file listing."""
+    # The page count is known from changed_files, so every page of the file
+    # list can be requested at once instead of following "next" links.
+    files_url = f"{pulls_url}/files"
+    changed = min(changed_files, GITHUB_MAX_FILES)
+    n_pages = max(1, -(-changed // GITHUB_PAGE_SIZE))
+
+    def fetch_page(client: Github, page: int) -> List[Dict[str, Any]]:
+        _, data = client.requester.requestJsonAndCheck(
+            "GET",
+            files_url,
+            parameters={"per_page": GITHUB_PAGE_SIZE, "page": page},
+        )
+        return data or []
+
+    if n_pages == 1:
+        pages = [fetch_page(gh, 1)]
+    else:
+        # A Requester keeps one connection that holds per-request state
+        # between sending and reading, so it must not be shared across
+        # threads: each pool thread gets its own client.
+        local = threading.local()
+
+        def fetch_page_pooled(page: int) -> List[Dict[str, Any]]:
+            client = getattr(local, "gh", None)
+            if client is None:
+                client = local.gh = _github_client()
+            return fetch_page(client, page)
+
+        with ThreadPoolExecutor(max_workers=min(n_pages, MAX_PAGE_WORKERS)) as pool:
+            pages = list(pool.map(fetch_page_pooled, range(1, n_pages + 1)))
+
+    return [
+        {
+            "filename": f["filename"],
+            "patch": f.get("patch") or "",
+            "additions": f["additions"],
+            "deletions": f["deletions"],
+        }
+        for page in pages
+        for f in page
+    ]
+
+
+def _etag_evict(now: float) -> None:
+    """Drop expired and over-limit ETag entries, oldest first; hold _etag_lock."""
+    global _etag_patch_chars
+    while _etag_cache:
+        key, entry = next(iter(_etag_cache.items()))
+        if (
+            now - entry[2] <= ETAG_CACHE_TTL
+            and len(_etag_cache) <= MAX_ETAG_ENTRIES
+            and _etag_patch_chars <= MAX_ETAG_PATCH_CHARS
+        ):
+            break
+        del _etag_cache[key]
+        _etag_patch_chars -= entry[3]
+
+
+def _etag_lookup(key: Tuple[str, int]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Return the cached (ETag, pr_info) for key, or None if absent or expired."""
+    with _etag_lock:
+        _etag_evict(time.monotonic())
+        entry = _etag_cache.get(key)
+    return (entry[0], entry[1]) if entry else None
+
+
+def _etag_touch(key: Tuple[str, int]) -> None:
+    """Mark key as just revalidated, keeping it from expiring."""
+    with _etag_lock:
+        entry = _etag_cache.get(key)
+        if entry is not None:
+            _etag_cache[key] = (entry[0], entry[1], time.monotonic(), entry[3])
+            _etag_cache.move_to_end(key)
+
+
+def _etag_store(key: Tuple[str, int], etag: str, pr_info: Dict[str, Any]) -> None:
+    """Cache pr_info under its ETag, evicting to stay within the limits."""
+    global _etag_patch_chars
+    size = sum(len(f["patch"]) for f in pr_info["files"])
+    if size > MAX_ETAG_PATCH_CHARS:
+        return
+    with _etag_lock:
+        old = _etag_cache.pop(key, None)
+        if old is not None:
+            _etag_patch_chars -= old[3]
+        _etag_cache[key] = (etag, pr_info, time.monotonic(), size)
+        _etag_patch_chars += size
+        _etag_evict(time.monotonic())
+
+
 def fetch_github_pr(pr_url: str) -> Dict[str, Any]:
     """Fetch a GitHub PR by URL and return PR info."""
-    m = PR_URL_PATTERN.match(pr_url)
+    m = PR_URL_PATTERN.fullmatch(pr_url)
     if not m:
         raise ValueError(
             "Invalid GitHub PR URL. Expected: https://github.com/owner/repo/pull/123"
         )
 
-    repo_name, pr_number = m.group(1), int(m.group(2))
+    owner, repo, pr_number = m.group(1), m.group(2), int(m.group(3))
+    repo_name = f"{owner}/{repo}"
     logger.info("Fetching PR %s #%s", repo_name, pr_number)
 
-    gh = Github(GITHUB_TOKEN) if GITHUB_TOKEN else Github()
-    repo = gh.get_repo(repo_name)
-    pr = repo.get_pull(pr_number)
+    gh = _github_client()
+    pulls_url = f"/repos/{repo_name}/pulls/{pr_number}"
+    key = (repo_name, pr_number)
+    cached = _etag_lookup(key)
 
-    files: List[Dict[str, Any]] = []
-    total_additions = 0
-    total_deletions = 0
-
-    for f in pr.get_files():
-        patch_text = f.patch or ""
-        files.append(
-            {
-                "filename": f.filename,
-                "patch": patch_text,
-                "additions": f.additions,
-                "deletions": f.deletions,
-            }
-        )
-        total_additions += f.additions
-        total_deletions += f.deletions
+    # Any push to the PR changes its ETag, so a 304 on the PR itself also
+    # means the cached file list is current.
+    headers = {"If-None-Match": cached[0]} if cached else None
+    status, resp_headers, output = gh.requester.requestJson(
+        "GET", pulls_url, headers=headers
+    )
+    if status == 304 and cached is not None:
+        logger.info("PR %s #%s not modified, using cached data", repo_name, pr_number)
+        _etag_touch(key)
+        return cached[1]
+
+    try:
+        raw = json.loads(output) if output else {}
+    except ValueError:
+        raw = {"message": output}
+    if status >= 400:
+        raise gh.requester.createException(status, resp_headers, raw)
+    pr = gh.create_from_raw_data(PullRequest, raw, resp_headers)
+
+    # One request for the whole unified diff; the paged file listing is only
+    # needed when GitHub will not render it (very large PRs).
+    changed = pr.changed_files or 0
+    files = None
+    if changed <= GITHUB_MAX_DIFF_FILES:
+        files = _fetch_files_from_diff(gh, pulls_url)
+    if files is None:
+        files = _fetch_files_paged(gh, pulls_url, changed)
+
+    total_additions = sum(f["additions"] for f in files)
+    total_deletions = sum(f["deletions"] for f in files)
 
     score = max(0, 100 - (total_additions + total_deletions))
 
-    return {
+    pr_info = {
         "repo_name": repo_name,
         "pr_number": pr_number,
         "title": pr.title,
@@ -75,61 +243,123 @@ def fetch_github_pr(pr_url: str) -> Dict[str, Any]:
         "score": score,
     }
 
+    etag = resp_headers.get("etag")
+    if etag:
+        _etag_store(key, etag, pr_info)
+
+    return pr_info
+
 
 # ---------------------------------------
 # Local Diff Parser
 # ---------------------------------------
-def parse_local_diff(diff_text: str) -> Dict[str, Any]:
-    """Parse a unified diff text into PR-like data format."""
+def _iter_lines(text: str) -> Iterator[str]:
+    """Yield lines of text lazily, without building a list of all lines."""
+    find = text.find
+    pos = 0
+    end = len(text)
+    while pos < end:
+        nl = find("\n", pos)
+        if nl < 0:
+            nl = end
+        yield text[pos:nl].rstrip("\r")
+        pos = nl + 1
+
+
+def _diff_file_entry(
+    filename: str, patch: str, additions: int, deletions: int
+) -> Dict[str, Any]:
+    """Build the PR-like file dict for one file of a local diff."""
+    return {
+        "filename": filename,
+        "patch": patch,
+        "additions": additions,
+        "deletions": deletions,
+    }
+
+
+# "@@ -start[,count] +start[,count] @@"; a missing count means 1
+_HUNK_RE = re.compile(r"@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+def _git_file_starts(text: str) -> List[int]:
+    """Return the start offsets of all "diff --git" lines in text, in order."""
+    # hunk body lines start with " ", "+", "-" or "\\", so these cannot be
+    # mistaken for diff content the way "+++"/"---" headers can
+    positions = [0] if text.startswith("diff --git ") else []
+    find = text.find
+    pos = find("\ndiff --git ")
+    while pos >= 0:
+        positions.append(pos + 1)
+        pos = find("\ndiff --git ", pos + 1)
+    return positions
+
+
+def _parse_diff_text(text: str, metadata_only: bool) -> List[Dict[str, Any]]:
+    """
+    Split an in-memory git diff into files without a per-line Python loop.
+
+    Files are delimited by their "diff --git" lines and each file's hunks by
+    its first "@@" line, so the patch is a single slice of text and every
+    line in it starting with "+" or "-" is a change; counts come from
+    str.count over that slice.
+    """
     files: List[Dict[str, Any]] = []
-    current_patch_lines: List[str] = []
-    filename = None
-    collecting = False
+    find = text.find
+    starts = _git_file_starts(text)
+    text_end = len(text) - 1 if text.endswith("\n") else len(text)
+    for i, start in enumerate(starts):
+        # the file runs up to the newline that ends its last line
+        end = starts[i + 1] - 1 if i + 1 < len(starts) else text_end
+        hunk = find("\n@@", start, end)
+        header_end = end if hunk < 0 else hunk
+        new_hdr = find("\n+++ ", start, header_end)
+        if new_hdr < 0:
+            # binary, rename-only or mode-only change: no text hunks
+            continue
+        name_end = find("\n", new_hdr + 1, header_end)
+        if name_end < 0:
+            name_end = header_end
+        if text.startswith("+++ b/", new_hdr + 1):
+            filename = text[new_hdr + 1 + len("+++ b/") : name_end].strip()
+        elif text.startswith("+++ /dev/null", new_hdr + 1):
+            # deleted file: take the name from the old-side header
+            old_hdr = find("\n--- a/", start, new_hdr)
+            if old_hdr < 0:
+                continue
+            filename = text[old_hdr + 1 + len("--- a/") : new_hdr].strip()
+        else:
+            continue
+        if hunk < 0:
+            files.append(_diff_file_entry(filename, "", 0, 0))
+            continue
+        # every hunk line is preceded by a newline, the one at hunk included
+        additions = text.count("\n+", hunk, end)
+        deletions = text.count("\n-", hunk, end)
+        patch = "" if metadata_only else text[hunk + 1 : end]
+        files.append(_diff_file_entry(filename, patch, additions, deletions))
+    return files
 
-    for line in diff_text.splitlines():
-        if line.startswith("+++ b/"):
-            # flush previous file
-            if collecting and filename:
-                files.append(
-                    {
-                        "filename": filename,
-                        "patch": "\n".join(current_patch_lines),
-                        "additions": sum(
-                            1
-                            for l in current_patch_lines
-                            if l.startswith("+") and not l.startswith("+++")
-                        ),
-                        "deletions": sum(
-                            1
-                            for l in current_patch_lines
-                            if l.startswith("-") and not l.startswith("---")
-                        ),
-                    }
-                )
-            filename = line[len("+++ b/") :].strip()
-            current_patch_lines = []
-            collecting = True
-        elif collecting:
-            current_patch_lines.append(line)
 
-    # flush last file
-    if collecting and filename:
-        files.append(
-            {
-                "filename": filename,
-                "patch": "\n".join(current_patch_lines),
-                "additions": sum(
-                    1
-                    for l in current_patch_lines
-                    if l.startswith("+") and not l.startswith("+++")
-                ),
-                "deletions": sum(
-                    1
-                    for l in current_patch_lines
-                    if l.startswith("-") and not l.startswith("---")
-                ),
-            }
-        )
+def parse_local_diff(
+    diff: Union[str, Iterable[str]], metadata_only: bool = False
+) -> Dict[str, Any]:
+    """
+    Parse a unified diff into PR-like data format.
+
+    diff may be the whole text or any iterable of lines (e.g. a text stream),
+    which is consumed in a single pass. With metadata_only, patch text is not
+    kept and each file's "patch" is empty; counts are still computed.
+    """
+    if (
+        isinstance(diff, str)
+        and "\r" not in diff
+        and (diff.startswith("diff --git ") or "\ndiff --git " in diff)
+    ):
+        files = _parse_diff_text(diff, metadata_only)
+    else:
+        lines = _iter_lines(diff) if isinstance(diff, str) else diff
+        files = _parse_diff_lines(lines, metadata_only)
 
     total_additions = sum(f["additions"] for f in files)
     total_deletions = sum(f["deletions"] for f in files)
@@ -145,45 +375,90 @@ def parse_local_diff(diff_text: str) -> Dict[str, Any]:
     }
 
 
-# ---------------------------------------
-# Flask Routes
-# ---------------------------------------
-@app.route("/")
-def index():
-    return render_template("index.html")  # make sure this exists in templates/
-
-
-@app.route("/review", methods=["POST"])
-def review():
-    """Endpoint to review either a GitHub PR or an uploaded diff file."""
-    try:
-        pr_url = request.form.get("pr_url", "").strip()
-        diff_file = request.files.get("diff_file")
-
-        if pr_url:
-            pr_data = fetch_github_pr(pr_url)
-        elif diff_file:
-            diff_text = diff_file.read().decode("utf-8")
-            pr_data = parse_local_diff(diff_text)
-        else:
-            return jsonify({"error": "No PR URL or diff file provided"}), 400
+def _parse_diff_lines(
+    lines: Iterable[str], metadata_only: bool
+) -> List[Dict[str, Any]]:
+    """Split a diff into files one line at a time.
 
-        return jsonify(pr_data)
+    Each "@@" hunk header gives the number of old and new lines that follow,
+    so changed lines are told apart from file headers by position rather
+    than by their text: "---"/"+++" inside a hunk are ordinary changes.
+    """
+    files: List[Dict[str, Any]] = []
+    # Patch lines are written straight into a buffer, so each line can be
+    # freed as soon as it is copied instead of living on in a list until join.
+    buf = io.StringIO()
+    write = buf.write
+    filename = None
+    collecting = False
+    additions = deletions = 0
+    old_left = new_left = 0  # lines still expected in the current hunk
 
-    except ValueError as ve:
-        logger.warning("Validation error: %s", ve)
-        return jsonify({"error": str(ve)}), 400
-    except GithubException.UnknownObjectException:
-        logger.warning("PR not found or repository is private")
-        return jsonify({"error": "PR not found or repository is private"}), 404
-    except Exception as e:
-        logger.exception("Internal server error")
-        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+    prev_line = ""
+    for line in lines:
+        line = line.rstrip("\r\n")
+        # dispatch on the first character; startswith only for header checks
+        c = line[:1]
+        if old_left > 0 or new_left > 0:
+            if c in ("+", "-", " ", "", "\\"):
+                if c == "+":
+                    additions += 1
+                    new_left -= 1
+                elif c == "-":
+                    deletions += 1
+                    old_left -= 1
+                elif c != "\\":
+                    # context; editors sometimes strip its lone space
+                    old_left -= 1
+                    new_left -= 1
+                if collecting and not metadata_only:
+                    write(line)
+                    write("\n")
+                prev_line = line
+                continue
+            # truncated hunk: handle this line as a header below
+            old_left = new_left = 0
 
+        if c == "@":
+            m = _HUNK_RE.match(line)
+            if m:
+                old_left = int(m.group(1) or 1)
+                new_left = int(m.group(2) or 1)
+                if collecting and not metadata_only:
+                    write(line)
+                    write("\n")
+        elif c == "\\":
+            # "\ No newline at end of file" after a hunk's last line
+            if collecting and not metadata_only:
+                write(line)
+                write("\n")
+        elif c == "+" and line.startswith(("+++ b/", "+++ /dev/null")):
+            # flush previous file
+            if collecting and filename:
+                files.append(
+                    _diff_file_entry(filename, buf.getvalue()[:-1], additions, deletions)
+                )
+            if line.startswith("+++ b/"):
+                filename = line[len("+++ b/") :].strip()
+            elif prev_line.startswith("--- a/"):
+                # deleted file: take the name from the old-side header
+                filename = prev_line[len("--- a/") :].strip()
+            else:
+                filename = None
+            buf.seek(0)
+            buf.truncate()
+            additions = deletions = 0
+            collecting = True
+        elif c == "d" and line.startswith("diff --git "):
+            # a new git file header: keep it out of the previous file's patch
+            if collecting and filename:
+                files.append(
+                    _diff_file_entry(filename, buf.getvalue()[:-1], additions, deletions)
+                )
+            collecting = False
+        prev_line = line
 
-# ---------------------------------------
-# Run App
-# ---------------------------------------
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 10000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    # flush last file
+    if collecting and filename:
+        files.append(_diff_file_entry(filename, buf.getvalue()[:-1], additions, deletions))
+    return files
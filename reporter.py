@@ -1,4 +1,4 @@
-from jinja2 import Template
+from jinja2 import Environment
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -39,7 +39,9 @@ HTML_TEMPLATE = """
         &nbsp; — <span class="additions">+{{ file.additions }}</span> / <span class="deletions">-{{ file.deletions }}</span>
       </div>
       <div class="card-body">
-        {% if file.issues %}
+        {% if file.skipped %}
+          <p>Skipped (generated or vendored file).</p>
+        {% elif file.issues %}
           <ul>
           {% for issue in file.issues %}
             <li class="issue"><strong>{{ issue.type }}</strong>: {{ issue.detail }}</li>
@@ -69,6 +71,11 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Compiled once at import; autoescape keeps patch text and titles from
+# injecting markup into the report.
+_ENV = Environment(autoescape=True)
+_TEMPLATE = _ENV.from_string(HTML_TEMPLATE)
+
+
 def build_html_report(pr_data, analysis):
-    t = Template(HTML_TEMPLATE)
-    return t.render(pr=pr_data, analysis=analysis)
+    return _TEMPLATE.render(pr=pr_data, analysis=analysis)